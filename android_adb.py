@@ -287,6 +287,28 @@ class AndroidUSB(__OSEssentials):
         else:
             print("[ %s ] >> [ANDROID] Error, One or more X & Y coordinate given are out of range!" % (self._get_pc_time()))
 
+    def _send_motion_event(self, action, x, y):
+        """ Sends a single low-level touch event (DOWN, MOVE or UP) at the given X and Y coordinate. """
+        if (x <= self.screen_resolution[0] and y <= self.screen_resolution[1]):
+            if self._verbose:
+                print("[ %s ] >> [ANDROID] Touch %s at (X,Y) = (%s,%s)." % (self._get_pc_time(), action, x, y))
+            command_to_send = "shell input motionevent {action} {x} {y}".format(action=action, x=x, y=y)
+            _ = self._send_command(command=command_to_send, print_command=self._verbose)
+        else:
+            print("[ %s ] >> [ANDROID] Error, the X & Y coordinate (%s,%s) given are out of range!" % (self._get_pc_time(), x, y))
+
+    def perform_press(self, x, y):
+        """ Presses and holds the screen at the given X and Y coordinate until perform_release is called. """
+        self._send_motion_event("DOWN", x, y)
+
+    def perform_move(self, x, y):
+        """ Moves the held finger to the given X and Y coordinate without lifting it. """
+        self._send_motion_event("MOVE", x, y)
+
+    def perform_release(self, x, y):
+        """ Lifts the held finger at the given X and Y coordinate. """
+        self._send_motion_event("UP", x, y)
+
     def type_text(self, text):
         """ Types some text on the screen. """
         if self._verbose:
@@ -305,6 +327,16 @@ class AndroidUSB(__OSEssentials):
         command_to_send = 'shell screencap {image_file}'.format(image_file=image_file)
         _ = self._send_command(command=command_to_send, print_command=self._verbose)
 
+    def capture_screen(self):
+        """ Captures the current screen and returns it as PNG encoded bytes without saving a file on the phone. """
+        if self._verbose:
+            print("[ %s ] >> [ANDROID] Capturing screen." % (self._get_pc_time()))
+        self._command = "adb -s {device_sn} exec-out screencap -p".format(device_sn=self.serial_number)
+
+        # The PNG data is binary, so the output must not be decoded as text.
+        output = subprocess.run(self._command, shell=True, capture_output=True)
+        return output.stdout
+
     def pop_screenshot(self, name, output_location):
         """ Pulls the screenshot from the Android phone and then removes it from the phone. """
         image_file = "/sdcard/Pictures/" + name
@@ -0,0 +1,650 @@
+"""
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Library Description:
+        A simulated Android device running ANOTHER EDEN, with the same
+        interface as android_adb.AndroidUSB. Everything runs on a virtual
+        clock, so hours of battles take seconds to simulate.
+
+   Usage:
+   -------------
+   python -m android_simulator --mode overworld --hours 10
+   python -m android_simulator --mode kof --hours 1 --disconnect_chance 0.001
+   python -m android_simulator --check
+
+   Or from python, pass the device and clock to the battle loops:
+   clock = VirtualClock(stop_after_s=3600)
+   android_device = SimulatedAndroidUSB(clock=clock)
+   another_eden_overworld_auto_battler(args, android_device=android_device, clock=clock)
+"""
+import argparse
+from button_layout import ButtonLayout, LAYOUT_CACHE_FILE, TEMPLATE_DIR
+import contextlib
+import datetime
+import os
+import overworld_battle_auto_clicker_another_eden as overworld
+import random
+import sys
+import tempfile
+import time
+
+try:
+    import cv2
+    import numpy
+except ImportError:
+    cv2 = None
+    numpy = None
+
+# Screen fractions (X, Y) of the buttons in the simulated game.
+SIMULATED_BUTTONS = {
+    "ATTACK": (0.80, 0.80),
+    "LP": (0.35, 0.75),
+    "HP": (0.50, 0.75),
+    "LK": (0.65, 0.75),
+    "HK": (0.85, 0.75),
+    "AF": (0.87, 0.15)
+}
+
+# Distance from a button center that still counts as tapping it, as a fraction of the screen width.
+SIMULATED_BUTTON_RADIUS = 0.05
+
+# Synthetic frames are rendered at a fraction of the screen resolution to keep them cheap.
+SIMULATED_FRAME_SCALE = 0.125
+
+# Synthetic frames are encoded as BMP rather than PNG. cv2.imdecode reads both the same way,
+# and decoding a PNG every capture took most of the simulation time.
+SIMULATED_FRAME_FORMAT = ".bmp"
+
+# BGR colors of the synthetic frames.
+SIMULATED_COLORS = {
+    "field": (60, 140, 70),
+    "encounter": (250, 250, 250),
+    "battle": (60, 30, 30),
+    "results": (150, 140, 130),
+    "returning": (0, 0, 0),
+    "kof_wait": (70, 40, 40),
+    "kof_turn": (70, 40, 40),
+    "kof_force": (90, 60, 60),
+    "button": (200, 200, 200),
+    "orange": (0, 140, 255),
+    "blue": (255, 120, 0),
+    "bar_off": (90, 90, 90),
+    "label": (40, 40, 40),
+    "banner": (230, 230, 230)
+}
+
+# Margin in pixels of background kept around the buttons and banners cropped as templates.
+SIMULATED_TEMPLATE_MARGIN = 4
+
+# Longest time without a completed battle that --check accepts, long enough for a few disconnects.
+CHECK_MAX_BATTLE_GAP_S = 600.0
+
+
+class SimulationTimeout(Exception):
+    """ Raised by the VirtualClock once the simulated time is up. """
+    pass
+
+
+class VirtualClock(object):
+    """ Drop-in replacement for the time module functions used by the battle loops. """
+
+    def __init__(self, stop_after_s=None):
+        """ Starts the clock at 0 seconds, optionally stopping the simulation after stop_after_s seconds. """
+        self._now = 0.0
+        self._stop_after_s = stop_after_s
+
+    def sleep(self, seconds):
+        """ Advances the clock instead of waiting. """
+        self._now += max(0.0, float(seconds))
+        if self._stop_after_s is not None and self._now >= self._stop_after_s:
+            raise SimulationTimeout("Simulated %.1f seconds." % self._now)
+
+    def monotonic(self):
+        """ Returns the simulated time in seconds. """
+        return self._now
+
+    def perf_counter(self):
+        """ Returns the simulated time in seconds. """
+        return self._now
+
+    def time(self):
+        """ Returns the simulated time in seconds. """
+        return self._now
+
+
+class SimulatedAndroidUSB(object):
+    """ Simulated Android device which plays ANOTHER EDEN overworld or KOF Symphony battles. """
+
+    manufacturer = "Simulator"
+    serial_number = None
+    model = None
+    image_version = None
+    screen_resolution = None
+    screen_orientation = None
+
+    _supported_events = {"back": "KEYCODE_BACK",
+                         "menu": "KEYCODE_MENU",
+                         "home": "KEYCODE_HOME",
+                         "wakeup": "KEYCODE_WAKEUP"}
+
+    def __init__(self, clock, device_sn="SIMULATOR", mode="overworld",
+                 screen_resolution=(2400, 1080), buttons=SIMULATED_BUTTONS,
+                 command_latency_s=(0.03, 0.15), disconnect_chance=0.0,
+                 disconnect_time_s=5.0, encounter_rate_per_s=0.15,
+                 battle_start_s=3.0, battle_duration_s=4.0,
+                 return_to_field_s=2.0, enemy_turn_s=4.0, kof_turns_per_battle=4,
+                 kof_super_every=3, kof_input_window_s=2.5, seed=None, verbose=False):
+        """
+            Sets up the simulated game in either "overworld" or "kof" mode.
+
+            Every command takes a random latency from command_latency_s, and
+            has a disconnect_chance of dropping the device for disconnect_time_s,
+            during which all commands are lost.
+        """
+        self._clock = clock
+        self._verbose = verbose
+        self._random = random.Random(seed)
+        self.serial_number = device_sn
+        self.model = "Another Eden Simulator (%s)" % mode
+        self.image_version = "1.0"
+        self.screen_resolution = (screen_resolution[0], screen_resolution[1])
+        self.screen_orientation = "landscape" if screen_resolution[0] >= screen_resolution[1] else "portrait"
+
+        self._mode = mode
+        self._buttons = {}
+        for name, fraction in buttons.items():
+            self._buttons[name] = (int(screen_resolution[0] * fraction[0]), int(screen_resolution[1] * fraction[1]))
+        self._button_radius = screen_resolution[0] * SIMULATED_BUTTON_RADIUS
+
+        self._command_latency_s = command_latency_s
+        self._disconnect_chance = disconnect_chance
+        self._disconnect_time_s = disconnect_time_s
+        self._offline_until = -1.0
+
+        self._encounter_rate_per_s = encounter_rate_per_s
+        self._battle_start_s = battle_start_s
+        self._battle_duration_s = battle_duration_s
+        self._return_to_field_s = return_to_field_s
+        self._enemy_turn_s = enemy_turn_s
+        self._kof_turns_per_battle = kof_turns_per_battle
+        self._kof_super_every = kof_super_every
+        self._kof_input_window_s = kof_input_window_s
+
+        self._walk_position = 0.0
+        self._walking_since = None
+        self._touch_down_at = None
+        self._touch_moved = False
+        self._walk_until_encounter_s = self._random.expovariate(self._encounter_rate_per_s)
+        self._kof_turn = 0
+        self._kof_inputs = 0
+        self._bar = None
+        self._frames = {}
+
+        self._statistics = {"battles_completed": 0,
+                            "kof_turns_completed": 0,
+                            "kof_inputs": 0,
+                            "commands": 0,
+                            "ignored_taps": 0,
+                            "dropped_commands": 0,
+                            "disconnects": 0,
+                            "battles_since_disconnect": 0,
+                            "longest_battle_gap_s": 0.0}
+        self._last_battle_at = 0.0
+
+        if self._mode == "kof":
+            self._set_state("kof_wait", self._enemy_turn_s)
+        else:
+            self._set_state("field")
+
+        print("[ %s ] >> [SIMULATOR] Simulated device %s in %s mode at (%s,%s)." % (self._get_pc_time(), self.serial_number, self._mode, self.screen_resolution[0], self.screen_resolution[1]))
+
+    def _get_pc_time(self):
+        """ Returns the simulated time as a datetime string. """
+        return datetime.timedelta(seconds=int(self._clock.monotonic()))
+
+    def _set_state(self, state, duration_s=None):
+        """ Switches the game state, which will end on its own after duration_s seconds if given. """
+        self._state = state
+        self._state_until = None if duration_s is None else self._clock.monotonic() + duration_s
+        if self._verbose:
+            print("[ %s ] >> [SIMULATOR] Game state = %s." % (self._get_pc_time(), state.upper()))
+
+    def _update(self):
+        """ Accounts for any walking and moves through all of the timed game states that have ended by now. """
+        now = self._clock.monotonic()
+        if self._walking_since is not None:
+            walked_s = now - self._walking_since
+            self._walking_since = now
+            if self._state == "field" and walked_s >= self._walk_until_encounter_s:
+                # The encounter started part way through the walk.
+                encounter_at = now - walked_s + self._walk_until_encounter_s
+                self._walk_position += self._walk_until_encounter_s
+                self._walk_until_encounter_s = self._random.expovariate(self._encounter_rate_per_s)
+                self._set_state("encounter")
+                self._state_until = encounter_at + self._battle_start_s
+            elif self._state == "field":
+                self._walk_until_encounter_s -= walked_s
+                self._walk_position += walked_s
+
+        while self._state_until is not None and self._clock.monotonic() >= self._state_until:
+            ended_at = self._state_until
+            if self._state == "encounter":
+                self._set_state("battle")
+            elif self._state == "battle_turn":
+                self._set_state("results")
+            elif self._state == "returning":
+                self._complete_battle()
+                self._set_state("field")
+            elif self._state == "kof_wait":
+                self._kof_turn += 1
+                self._bar = "blue" if self._kof_turn % self._kof_super_every == 0 else "orange"
+                self._set_state("kof_turn")
+            elif self._state == "kof_force":
+                self._end_kof_turn()
+            else:
+                self._state_until = None
+
+            # Keep the timeline exact even when the state ended in the middle of a command.
+            if self._state_until is not None:
+                self._state_until = ended_at + (self._state_until - self._clock.monotonic())
+
+    def _complete_battle(self):
+        """ Counts a won battle, along with the time since the one before it. """
+        now = self._clock.monotonic()
+        self._statistics["battles_completed"] += 1
+        self._statistics["battles_since_disconnect"] += 1
+        self._statistics["longest_battle_gap_s"] = max(self._statistics["longest_battle_gap_s"], now - self._last_battle_at)
+        self._last_battle_at = now
+
+    def _end_kof_turn(self):
+        """ Resolves the turn after the input window of the Another Force closes. """
+        self._bar = None
+        if self._kof_inputs > 0:
+            self._statistics["kof_turns_completed"] += 1
+        self._kof_inputs = 0
+
+        if self._kof_turn % self._kof_turns_per_battle == 0:
+            self._set_state("results")
+        else:
+            self._set_state("kof_wait", self._enemy_turn_s)
+
+    def _send_command(self):
+        """ Simulates the adb round trip, returning False if the command was lost to a disconnect. """
+        self._statistics["commands"] += 1
+        self._clock.sleep(self._random.uniform(self._command_latency_s[0], self._command_latency_s[1]))
+        self._update()
+
+        if self._clock.monotonic() < self._offline_until:
+            self._statistics["dropped_commands"] += 1
+            return False
+
+        if self._random.random() < self._disconnect_chance:
+            print("[ %s ] >> [SIMULATOR] Device disconnected for %s seconds." % (self._get_pc_time(), self._disconnect_time_s))
+            self._statistics["disconnects"] += 1
+            self._statistics["battles_since_disconnect"] = 0
+            self._statistics["dropped_commands"] += 1
+            self._offline_until = self._clock.monotonic() + self._disconnect_time_s
+            return False
+
+        return True
+
+    def _is_on_button(self, name, x, y):
+        """ Returns whether (x, y) is within reach of the button. """
+        if name not in self._buttons:
+            return False
+        button = self._buttons[name]
+        return (x - button[0]) ** 2 + (y - button[1]) ** 2 <= self._button_radius ** 2
+
+    def _tap(self, x, y):
+        """ Applies a single tap to the current game state. """
+        if self._state == "battle" and self._is_on_button("ATTACK", x, y):
+            self._set_state("battle_turn", self._battle_duration_s)
+        elif self._state == "results":
+            if self._mode == "kof":
+                self._complete_battle()
+                self._set_state("kof_wait", self._enemy_turn_s)
+            else:
+                self._set_state("returning", self._return_to_field_s)
+        elif self._state == "kof_turn" and self._is_on_button("AF", x, y):
+            self._set_state("kof_force", self._kof_input_window_s)
+        elif self._state == "kof_force" and any(self._is_on_button(name, x, y) for name in ["LP", "HP", "LK", "HK"]):
+            # Every input keeps the Another Force going for another input window.
+            self._kof_inputs += 1
+            self._statistics["kof_inputs"] += 1
+            self._set_state("kof_force", self._kof_input_window_s)
+        else:
+            self._statistics["ignored_taps"] += 1
+
+    def _element_box(self, name):
+        """ Returns the (left, top, right, bottom) box of a button or the RESULTS banner on the synthetic frame. """
+        width = int(self.screen_resolution[0] * SIMULATED_FRAME_SCALE)
+        height = int(self.screen_resolution[1] * SIMULATED_FRAME_SCALE)
+        if name == "RESULTS":
+            return (width // 3, height // 8, 2 * width // 3, height // 4)
+
+        center = (int(self._buttons[name][0] * SIMULATED_FRAME_SCALE), int(self._buttons[name][1] * SIMULATED_FRAME_SCALE))
+        radius = int(self._button_radius * SIMULATED_FRAME_SCALE * 0.8)
+        return (center[0] - radius, center[1] - radius, center[0] + radius, center[1] + radius)
+
+    def _draw_frame(self, state, bar, walk_offset):
+        """ Returns the synthetic BGR frame of the game state. """
+        width = int(self.screen_resolution[0] * SIMULATED_FRAME_SCALE)
+        height = int(self.screen_resolution[1] * SIMULATED_FRAME_SCALE)
+        state_color = SIMULATED_COLORS.get(state, SIMULATED_COLORS["battle"])
+        frame = numpy.full((height, width, 3), state_color, dtype=numpy.uint8)
+
+        if state == "field":
+            for stripe_x in range(walk_offset * width // 64, width, width // 8):
+                cv2.rectangle(frame, (stripe_x, height // 2), (stripe_x + width // 32, height), (40, 100, 50), -1)
+        elif state == "results":
+            box = self._element_box("RESULTS")
+            cv2.rectangle(frame, box[:2], box[2:], SIMULATED_COLORS["banner"], -1)
+            cv2.putText(frame, "RESULTS", (box[0] + 4, box[3] - 4), cv2.FONT_HERSHEY_PLAIN, 1.0, SIMULATED_COLORS["label"], 1)
+
+        visible_buttons = []
+        if state in ["battle", "battle_turn"]:
+            visible_buttons = ["ATTACK"]
+        elif state in ["kof_wait", "kof_turn", "kof_force"]:
+            visible_buttons = ["AF"]
+            if state == "kof_force":
+                visible_buttons += ["LP", "HP", "LK", "HK"]
+
+        for name in visible_buttons:
+            box = self._element_box(name)
+            if name == "AF":
+                # The AF button is the bar, which is read by its color.
+                color = SIMULATED_COLORS[bar] if state == "kof_turn" else SIMULATED_COLORS["bar_off"]
+                cv2.rectangle(frame, box[:2], box[2:], color, -1)
+            else:
+                # The other buttons are labelled so each one has its own template.
+                cv2.rectangle(frame, box[:2], box[2:], SIMULATED_COLORS["button"], -1)
+                cv2.putText(frame, name[:2], (box[0] + 3, box[3] - 6), cv2.FONT_HERSHEY_PLAIN, 0.8, SIMULATED_COLORS["label"], 1)
+
+        return frame
+
+    def _render_frame(self):
+        """ Returns the encoded synthetic frame (see SIMULATED_FRAME_FORMAT) for the current game state. """
+        if cv2 is None:
+            return b""
+
+        # The field scrolls while walking, so those frames change slightly.
+        walk_offset = int(self._walk_position * 4) % 8 if self._state == "field" else 0
+        frame_key = (self._state, self._bar, walk_offset)
+        if frame_key not in self._frames:
+            frame = self._draw_frame(self._state, self._bar, walk_offset)
+            self._frames[frame_key] = cv2.imencode(SIMULATED_FRAME_FORMAT, frame)[1].tobytes()
+
+        return self._frames[frame_key]
+
+    def write_templates(self, template_dir):
+        """ Crops the buttons and the RESULTS banner out of the synthetic frames into template_dir, as for a ButtonLayout. """
+        if cv2 is None:
+            return
+
+        os.makedirs(template_dir, exist_ok=True)
+        template_states = {"ATTACK": "battle", "RESULTS": "results"}
+        template_states.update({name: "kof_force" for name in ["LP", "HP", "LK", "HK", "AF"]})
+        for name, state in template_states.items():
+            frame = self._draw_frame(state, None, 0)
+            box = self._element_box(name)
+            template = frame[max(0, box[1] - SIMULATED_TEMPLATE_MARGIN):box[3] + SIMULATED_TEMPLATE_MARGIN + 1,
+                             max(0, box[0] - SIMULATED_TEMPLATE_MARGIN):box[2] + SIMULATED_TEMPLATE_MARGIN + 1]
+            cv2.imwrite(os.path.join(template_dir, name + ".png"), template)
+
+    def get_statistics(self):
+        """ Returns the counters of the simulation along with the battle throughput. """
+        statistics = dict(self._statistics)
+        statistics["virtual_time_s"] = self._clock.monotonic()
+        statistics["longest_battle_gap_s"] = max(statistics["longest_battle_gap_s"], statistics["virtual_time_s"] - self._last_battle_at)
+        hours = statistics["virtual_time_s"] / 3600.0
+        statistics["battles_per_hour"] = statistics["battles_completed"] / hours if hours > 0 else 0.0
+        return statistics
+
+    def get_screen_orientation(self):
+        """ Checks the current screen orientation. """
+        self._send_command()
+        return self.screen_orientation
+
+    def get_screen_resolution(self):
+        """ Checks the current screen resolution. """
+        self._send_command()
+        return self.screen_resolution
+
+    def send_keycode(self, keycode_string):
+        """ Sends a keycode event, which has no effect on the simulated game. """
+        self._send_command()
+
+    def send_event(self, supported_event):
+        """ Sends a keycode as an event name that is supported """
+        supported_events = list(self._supported_events.keys())
+        if supported_event in supported_events:
+            self.send_keycode(self._supported_events[supported_event])
+        else:
+            print("The event=%s, is not supported! (SUPPORTED=%s)" % (supported_event, supported_events))
+
+    def perform_tap(self, x, y, repeat_count=1, repeat_interval_ms=1000):
+        """ Perform a tap to the given X and Y coordinate repeatedly based on repeat_count value at an interval of repeat_interval_ms (milliseconds). """
+        if (x <= self.screen_resolution[0] and y <= self.screen_resolution[1]):
+            for loop_number in range(repeat_count):
+                if self._send_command():
+                    self._tap(x, y)
+
+                if (repeat_count > 1 and loop_number < (repeat_count - 1)):
+                    self._clock.sleep(repeat_interval_ms / 1000)
+        else:
+            print("[ %s ] >> [SIMULATOR] Error, the X & Y coordinate (%s,%s) given are out of range!" % (self._get_pc_time(), x, y))
+
+    def perform_swipe(self, coord1, coord2, length_ms=3000):
+        """ Perform a swipe for length_ms (milliseconds) from coord1 (x1,y1) to coord2 (x2,y2), walking on the field. """
+        if (coord1[0] <= self.screen_resolution[0] and coord1[1] <= self.screen_resolution[1]) and (coord2[0] <= self.screen_resolution[0] and coord2[1] <= self.screen_resolution[1]):
+            if self._send_command():
+                # The character walks for as long as the swipe lasts.
+                self._walking_since = self._clock.monotonic()
+                self._clock.sleep(length_ms / 1000)
+                self._update()
+                self._walking_since = None
+        else:
+            print("[ %s ] >> [SIMULATOR] Error, One or more X & Y coordinate given are out of range!" % (self._get_pc_time()))
+
+    def perform_press(self, x, y):
+        """ Presses and holds the screen at the given X and Y coordinate until perform_release is called. """
+        if self._send_command():
+            self._touch_down_at = (x, y)
+            self._touch_moved = False
+
+    def perform_move(self, x, y):
+        """ Moves the held finger, walking for as long as it is held away from where it was pressed. """
+        if self._send_command() and self._touch_down_at is not None:
+            self._touch_moved = True
+            distance = ((x - self._touch_down_at[0]) ** 2 + (y - self._touch_down_at[1]) ** 2) ** 0.5
+            if distance > self._button_radius and self._walking_since is None:
+                self._walking_since = self._clock.monotonic()
+            elif distance <= self._button_radius:
+                self._walking_since = None
+
+    def perform_release(self, x, y):
+        """ Lifts the held finger, which counts as a tap if it was never moved. """
+        if self._send_command() and self._touch_down_at is not None:
+            self._walking_since = None
+            if not self._touch_moved:
+                self._tap(x, y)
+            self._touch_down_at = None
+
+    def type_text(self, text):
+        """ Types some text on the screen, which has no effect on the simulated game. """
+        self._send_command()
+
+    def capture_screen(self):
+        """ Captures the current screen and returns it as encoded bytes (see SIMULATED_FRAME_FORMAT). """
+        if not self._send_command():
+            return b""
+        return self._render_frame()
+
+    def take_screenshot(self, name):
+        """ Takes a screenshot on the simulated phone. """
+        self._send_command()
+
+    def pop_screenshot(self, name, output_location):
+        """ Writes the current synthetic frame to output_location. """
+        if self._send_command():
+            with open(output_location, 'wb') as file:
+                file.write(self._render_frame())
+
+    def TearDown(self):
+        """Closes the connection to the device."""
+        pass
+
+
+def simulate(args):
+    """ Runs the chosen battle loop on the simulated device, returning its statistics with the speedup over real time. """
+    if args.mode == "kof":
+        # Only the KOF battler needs pyyaml and opencv-python.
+        import kof_symphony_another_eden as kof
+        if cv2 is None:
+            print("[SIMULATOR] Error, the KOF autopilot needs opencv-python and numpy to read the screen!")
+            return None
+
+    clock = VirtualClock(stop_after_s=args.hours * 3600)
+
+    wall_clock_start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull) if args.quiet else contextlib.nullcontext():
+        android_device = SimulatedAndroidUSB(clock=clock,
+                                             mode=args.mode,
+                                             screen_resolution=(args.screen_x, args.screen_y),
+                                             command_latency_s=(args.min_latency, args.max_latency),
+                                             disconnect_chance=args.disconnect_chance,
+                                             seed=args.seed)
+
+        # Keep the simulated layout away from the button cache and templates of real devices,
+        # the simulated game has templates of its own.
+        with tempfile.TemporaryDirectory() as layout_dir:
+            if not args.no_templates:
+                android_device.write_templates(os.path.join(layout_dir, TEMPLATE_DIR))
+            layout = ButtonLayout(cache_file=os.path.join(layout_dir, LAYOUT_CACHE_FILE),
+                                  template_dir=os.path.join(layout_dir, TEMPLATE_DIR))
+            try:
+                if args.mode == "kof":
+                    with open(kof.YAML_FILE, 'r') as file:
+                        command_list = kof.yaml.safe_load(file)
+                    buttons = kof.obtain_kof_battle_buttons(android_device, layout=layout)
+                    state_cache = None
+                    if args.state_cache:
+                        state_cache = kof.obtain_kof_results_cache(android_device, layout)
+                    kof.kof_battler_autopilot(android_device, buttons, command_list, [args.fighter],
+                                              wait_time_for_another_force_s=1.5,
+                                              button_press_delay_s=0.75,
+                                              poll_interval_s=0.1,
+                                              idle_tap_time_s=10.0,
+                                              layout=layout,
+                                              state_cache=state_cache,
+                                              clock=clock)
+                else:
+                    overworld_args = argparse.Namespace(battle_start_time=args.battle_start_time,
+                                                        battle_end_time=args.battle_end_time,
+                                                        return_to_battlefield_time=args.return_to_battlefield_time,
+                                                        max_walk_time=args.max_walk_time,
+                                                        walk_stride_time=3.0,
+                                                        encounter_poll_time=0.2,
+                                                        swipe_walk=args.swipe_walk,
+                                                        recalibrate=False)
+                    overworld.another_eden_overworld_auto_battler(overworld_args, android_device=android_device,
+                                                                  clock=clock, layout=layout)
+            except SimulationTimeout:
+                pass
+    wall_clock_s = time.perf_counter() - wall_clock_start
+
+    statistics = android_device.get_statistics()
+    statistics["speedup"] = statistics["virtual_time_s"] / max(wall_clock_s, 1e-9)
+    return statistics
+
+
+def run_simulation(args):
+    """ Runs the chosen battle loop on the simulated device and prints the throughput. """
+    statistics = simulate(args)
+    if statistics is None:
+        return
+
+    print("=====================================================")
+    print("----- Simulation Results (%s)" % args.mode)
+    print("=====================================================")
+    for name in sorted(statistics.keys()):
+        print("\t\t%s: %s" % (name, round(statistics[name], 2)))
+
+
+def check_simulation(args):
+    """
+        Runs short seeded simulations of every battle loop that can run here
+        with disconnects, and exits with an error unless battles were won
+        and the loop never went CHECK_MAX_BATTLE_GAP_S seconds without one,
+        which a loop stuck after a disconnect would. The KOF autopilot
+        runs with the screen state cache for the results screen.
+    """
+    modes = ["overworld"]
+    if cv2 is not None:
+        modes.append("kof")
+
+    failures = []
+    for mode in modes:
+        check_args = argparse.Namespace(**vars(args))
+        check_args.mode = mode
+        check_args.hours = 2.0
+        check_args.seed = 1 if args.seed is None else args.seed
+        check_args.disconnect_chance = 0.002
+        check_args.state_cache = mode == "kof"
+        check_args.quiet = True
+
+        statistics = simulate(check_args)
+        print("[SIMULATOR] %s: battles = %s, disconnects = %s, longest time without a battle = %.0f s, speedup = %.0fx" % (
+            mode, statistics["battles_completed"], statistics["disconnects"], statistics["longest_battle_gap_s"], statistics["speedup"]))
+
+        if statistics["battles_completed"] <= 0:
+            failures.append("%s: no battles completed" % mode)
+        if statistics["disconnects"] <= 0:
+            failures.append("%s: no disconnects were simulated" % mode)
+        if statistics["longest_battle_gap_s"] > CHECK_MAX_BATTLE_GAP_S:
+            failures.append("%s: no battles completed for %.0f seconds" % (mode, statistics["longest_battle_gap_s"]))
+
+    for failure in failures:
+        print("[SIMULATOR] CHECK FAILED: %s" % failure)
+    if failures:
+        sys.exit(1)
+    print("[SIMULATOR] CHECK PASSED")
+
+
+if __name__ == "__main__":
+    # Use parser for the help menu and to return as args to the main function..
+    parser = argparse.ArgumentParser(prog='ANOTHER EDEN Simulator', description='Runs the ANOTHER EDEN battle loops against a simulated device on a virtual clock.')
+    parser.add_argument("--mode", action='store', type=str, choices=["overworld", "kof"], default="overworld", help='Which battle loop to simulate.')
+    parser.add_argument("--hours", action='store', type=float, default=1.0, required=False, help='Simulated time to run for in hours.')
+    parser.add_argument("--seed", action='store', type=int, required=False, help='Random seed for repeatable runs.')
+    parser.add_argument("--screen_x", action='store', type=int, default=2400, required=False, help='Simulated screen width.')
+    parser.add_argument("--screen_y", action='store', type=int, default=1080, required=False, help='Simulated screen height.')
+    parser.add_argument("--min_latency", action='store', type=float, default=0.03, required=False, help='Minimum adb command latency in seconds.')
+    parser.add_argument("--max_latency", action='store', type=float, default=0.15, required=False, help='Maximum adb command latency in seconds.')
+    parser.add_argument("--disconnect_chance", action='store', type=float, default=0.0, required=False, help='Chance of each command disconnecting the device.')
+    parser.add_argument("--fighter", action='store', type=str, default="kyo", required=False, help='Fighter used by the KOF autopilot.')
+    parser.add_argument("--battle_start_time", action='store', type=int, required=False, default=4, help='Battle Start wait time in seconds.')
+    parser.add_argument("--battle_end_time", action='store', type=int, required=False, default=5, help='Battle End wait time in seconds.')
+    parser.add_argument("--return_to_battlefield_time", action='store', type=int, required=False, default=4, help='Return to battlefield wait time in seconds.')
+    parser.add_argument("--max_walk_time", action='store', type=float, required=False, help='Releases and walks again after this many seconds without an encounter.')
+    parser.add_argument("--swipe_walk", action='store_true', help='Walks with three fixed swipes instead of holding until an encounter.')
+    parser.add_argument("--state_cache", action='store_true', help='Has the KOF autopilot look for the results screen on every sample through the screen state cache.')
+    parser.add_argument("--no_templates", action='store_true', help='Runs without the button and results screen templates of the simulated game, so the default screen fractions are used.')
+    parser.add_argument("--quiet", action='store_true', help='Hides the output of the battle loop.')
+    parser.add_argument("--check", action='store_true', help='Runs short seeded simulations with disconnects and fails unless battles keep being won.')
+    parser.add_argument('--version', action='version', version='%(prog)s 1.0')
+    args = parser.parse_args()
+    if args.check:
+        check_simulation(args)
+    else:
+        run_simulation(args)
@@ -0,0 +1,213 @@
+"""
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Library Description:
+        Locates the in-game buttons on a captured frame with multi-scale
+        template matching and caches the pixel coordinates per device
+        and screen orientation.
+
+   Usage:
+   -------------
+   layout = ButtonLayout()
+   buttons = layout.get_buttons(android_device, {"AF": (0.87, 0.15)})
+   android_device.perform_tap(x=buttons["AF"][0], y=buttons["AF"][1])
+
+   Button templates are cropped screenshots of each button saved as
+   <BUTTON_NAME>.png (ie. LP.png, ATTACK.png) in the TEMPLATE_DIR folder.
+   Screens are told apart the same way, with a template of something only
+   that screen shows (ie. RESULTS.png):
+   screen = layout.find_screen(frame, ["RESULTS"])
+   Template matching needs opencv-python and numpy; without them, or
+   without a template, the default screen fractions are used instead.
+"""
+import datetime
+import json
+import os
+
+try:
+    import cv2
+    import numpy
+except ImportError:
+    cv2 = None
+    numpy = None
+
+LAYOUT_CACHE_FILE = "button_layout_cache.json"
+TEMPLATE_DIR = "button_templates"
+
+# Minimum normalized correlation for a template match to be trusted.
+MATCH_THRESHOLD = 0.80
+
+# Template scales to search, relative to the size the template was cropped at.
+MATCH_SCALES = [0.50, 0.60, 0.70, 0.80, 0.90, 1.00, 1.15, 1.30, 1.50, 1.75, 2.00]
+
+
+class ButtonLayout(object):
+    """ Per-device and per-orientation cache of calibrated button coordinates. """
+
+    def __init__(self, cache_file=LAYOUT_CACHE_FILE, template_dir=TEMPLATE_DIR,
+                 match_threshold=MATCH_THRESHOLD, verbose=False):
+        """ Loads any previously calibrated layouts from the cache file. """
+        self._cache_file = cache_file
+        self._template_dir = template_dir
+        self._match_threshold = match_threshold
+        self._verbose = verbose
+        self._layouts = {}
+        self._templates = {}
+
+        if os.path.isfile(self._cache_file):
+            with open(self._cache_file, 'r') as file:
+                self._layouts = json.load(file)
+
+    def _get_pc_time(self):
+        """ Returns the PC time as a datetime string. """
+        return datetime.datetime.now()
+
+    def _save(self):
+        """ Writes all of the calibrated layouts to the cache file. """
+        with open(self._cache_file, 'w') as file:
+            json.dump(self._layouts, file, indent=4, sort_keys=True)
+
+    def get_buttons(self, android_device, button_fractions, recalibrate=False, calibrate=True):
+        """
+            Returns dictionary of x and y pixel coordinates for each button
+            name in button_fractions.
+
+            The layout is only calibrated for buttons that have not been
+            found before on this device and orientation, or when the screen
+            resolution differs from the one the layout was calibrated at.
+            button_fractions holds the (X, Y) screen fractions which are used
+            when a button cannot be located on the screen. With calibrate=False
+            the screen is not searched, for when the buttons aren't visible yet.
+        """
+        screen_size = android_device.get_screen_resolution()
+        layout_key = "%s/%s" % (android_device.serial_number, android_device.screen_orientation)
+
+        layout = self._layouts.get(layout_key)
+        if recalibrate or layout is None or tuple(layout["resolution"]) != tuple(screen_size):
+            print("[ %s ] >> [LAYOUT] No calibrated layout for %s at (%s,%s)." % (self._get_pc_time(), layout_key, screen_size[0], screen_size[1]))
+            layout = {"resolution": list(screen_size), "buttons": {}}
+            self._layouts[layout_key] = layout
+
+        # Only the buttons which were never located need to be searched for.
+        missing_buttons = [name for name in button_fractions if name not in layout["buttons"]]
+        if missing_buttons and calibrate:
+            found_buttons = self.calibrate(android_device, missing_buttons, screen_size)
+            if found_buttons:
+                layout["buttons"].update(found_buttons)
+                self._save()
+
+        buttons = {}
+        for name, fraction in button_fractions.items():
+            if name in layout["buttons"]:
+                buttons[name] = tuple(layout["buttons"][name])
+            else:
+                # Fallbacks are not cached so calibration is retried on the next start.
+                buttons[name] = (int(screen_size[0] * fraction[0]), int(screen_size[1] * fraction[1]))
+                if self._verbose:
+                    print("[ %s ] >> [LAYOUT] Using default screen fraction for button [ %s ] = (%s,%s)." % (self._get_pc_time(), name, buttons[name][0], buttons[name][1]))
+
+        return buttons
+
+    def has_buttons(self, android_device, button_names):
+        """ Returns whether every button in button_names is calibrated for the last known resolution of the device. """
+        layout_key = "%s/%s" % (android_device.serial_number, android_device.screen_orientation)
+        layout = self._layouts.get(layout_key)
+        if layout is None or tuple(layout["resolution"]) != tuple(android_device.screen_resolution):
+            return False
+
+        return all(name in layout["buttons"] for name in button_names)
+
+    def has_templates(self, names):
+        """ Returns whether there is a template for every name in names. """
+        return all(os.path.isfile(os.path.join(self._template_dir, name + ".png")) for name in names)
+
+    def _load_template(self, name):
+        """ Returns the grayscale template for the name, or None if there is none. """
+        if name not in self._templates:
+            template_file = os.path.join(self._template_dir, name + ".png")
+            self._templates[name] = cv2.imread(template_file, cv2.IMREAD_GRAYSCALE) if os.path.isfile(template_file) else None
+        return self._templates[name]
+
+    def find_screen(self, frame, screen_names):
+        """ Returns the first name in screen_names whose template is found on the decoded frame, or None. """
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        for name in screen_names:
+            template = self._load_template(name)
+            if template is None:
+                continue
+            score, _ = self._match_template(frame, template)
+            if score >= self._match_threshold:
+                return name
+
+        return None
+
+    def calibrate(self, android_device, button_names, screen_size):
+        """ Captures a frame and returns the pixel coordinates of every button in button_names that could be located. """
+        if cv2 is None:
+            print("[ %s ] >> [LAYOUT] opencv-python is not installed, skipping button calibration." % self._get_pc_time())
+            return {}
+
+        templates = {}
+        for name in button_names:
+            template = self._load_template(name)
+            if template is not None:
+                templates[name] = template
+        if not templates:
+            return {}
+
+        print("[ %s ] >> [LAYOUT] Calibrating buttons %s..." % (self._get_pc_time(), list(templates.keys())))
+        screen = android_device.capture_screen()
+        frame = cv2.imdecode(numpy.frombuffer(screen, dtype=numpy.uint8), cv2.IMREAD_GRAYSCALE) if screen else None
+        if frame is None:
+            print("[ %s ] >> [LAYOUT] Error, unable to capture the screen for calibration!" % self._get_pc_time())
+            return {}
+
+        # The captured frame may not be the same size as the reported screen resolution.
+        frame_height, frame_width = frame.shape[:2]
+        scale_x = screen_size[0] / float(frame_width)
+        scale_y = screen_size[1] / float(frame_height)
+
+        found_buttons = {}
+        for name, template in templates.items():
+            score, center = self._match_template(frame, template)
+            if score >= self._match_threshold:
+                found_buttons[name] = [int(center[0] * scale_x), int(center[1] * scale_y)]
+                if self._verbose:
+                    print("[ %s ] >> [LAYOUT] Found button [ %s ] at (%s,%s), score = %.2f." % (self._get_pc_time(), name, found_buttons[name][0], found_buttons[name][1], score))
+            elif self._verbose:
+                print("[ %s ] >> [LAYOUT] Could not find button [ %s ], best score = %.2f." % (self._get_pc_time(), name, score))
+
+        return found_buttons
+
+    def _match_template(self, frame, template):
+        """ Returns the best match score and (x, y) center of the template across all MATCH_SCALES. """
+        best_score = -1.0
+        best_center = (0, 0)
+        frame_height, frame_width = frame.shape[:2]
+
+        for scale in MATCH_SCALES:
+            width = int(template.shape[1] * scale)
+            height = int(template.shape[0] * scale)
+            if width < 8 or height < 8 or width > frame_width or height > frame_height:
+                continue
+
+            scaled_template = cv2.resize(template, (width, height), interpolation=cv2.INTER_AREA)
+            result = cv2.matchTemplate(frame, scaled_template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, location = cv2.minMaxLoc(result)
+            if score > best_score:
+                best_score = score
+                best_center = (location[0] + width // 2, location[1] + height // 2)
+
+        return best_score, best_center
@@ -23,9 +23,20 @@
 """
 import android_adb as Android
 import argparse
+from button_layout import ButtonLayout
+import functools
+import itertools
+from screen_state_cache import ScreenStateCache, device_cache_file
 import time
 import yaml
 
+try:
+    import cv2
+    import numpy
+except ImportError:
+    cv2 = None
+    numpy = None
+
 YAML_FILE="kof_symphony_commmand_list.yaml"
 COMMAND_BUTTONS = {
     "LP": (0.35, 0.75),
@@ -35,6 +46,28 @@ COMMAND_BUTTONS = {
     "AF": (0.87, 0.15)
 }
 
+# Size of the area around the AF button sampled for the bar color, as screen fractions (X, Y).
+BAR_SAMPLE_SIZE = (0.06, 0.06)
+BAR_MIN_SATURATION = 120
+BAR_MIN_VALUE = 120
+BAR_MIN_LIT_RATIO = 0.30
+
+# OpenCV hue ranges (0-179) of the AF/MAX bar colors.
+BAR_HUES = {
+    "orange": (5, 25),
+    "blue": (95, 130)
+}
+
+# Maximum number of combos (including the Super) the autopilot chains in a single turn.
+AUTOPILOT_MAX_CHAIN_LENGTH = 3
+AUTOPILOT_LATENCY_BUDGET_S = 0.5
+
+# Template (in the button layout TEMPLATE_DIR) of something only the results screen shows.
+RESULTS_SCREEN = "RESULTS"
+
+# Without a results screen template, a battle only counts as over after this long without a turn.
+AUTOPILOT_NEW_BATTLE_TIME_S = 60.0
+
 
 def obtain_device_configuration(args):
     """ 
@@ -45,29 +78,28 @@ def obtain_device_configuration(args):
     return Android.AndroidUSB(device_sn=args.serial_number, verbose=args.verbose)
 
 
-def obtain_kof_battle_buttons(screen_size):
-    """ Returns dictionary of x and y coordinates for tapping the appropriate buttons. """
-    another_force = (int(screen_size[0] * COMMAND_BUTTONS["AF"][0]), int(screen_size[1] * COMMAND_BUTTONS["AF"][1]))
-    light_punch = (int(screen_size[0] * COMMAND_BUTTONS["LP"][0]), int(screen_size[1] * COMMAND_BUTTONS["LP"][1]))
-    heavy_punch = (int(screen_size[0] * COMMAND_BUTTONS["HP"][0]), int(screen_size[1] * COMMAND_BUTTONS["HP"][1]))
-    light_kick = (int(screen_size[0] * COMMAND_BUTTONS["LK"][0]), int(screen_size[1] * COMMAND_BUTTONS["LK"][1]))
-    heavy_kick = (int(screen_size[0] * COMMAND_BUTTONS["HK"][0]), int(screen_size[1] * COMMAND_BUTTONS["HK"][1]))
+def obtain_kof_battle_buttons(android_device, recalibrate=False, layout=None):
+    """
+        Returns dictionary of x and y coordinates for tapping the appropriate buttons.
 
-    # Generate a dictionary for the X & Y screen coordinates of the respective buttons during the battle.
-    buttons = {
-        "AF": another_force,
-        "LP": light_punch,
-        "HP": heavy_punch,
-        "LK": light_kick,
-        "HK": heavy_kick
-    }
+        The coordinates are served from the layout cache, falling back on
+        the screen fractions in COMMAND_BUTTONS for any button that has not
+        been located yet. LP/HP/LK/HK are only on screen once AF is tapped,
+        so the layout is calibrated by start_kof_command_sequence instead.
+        A ButtonLayout can be given to use a different cache file.
+    """
+    if layout is None:
+        layout = ButtonLayout(verbose=android_device._verbose)
 
-    return buttons
+    # Generate a dictionary for the X & Y screen coordinates of the respective buttons during the battle.
+    return layout.get_buttons(android_device, COMMAND_BUTTONS, recalibrate=recalibrate, calibrate=False)
 
 
 def start_kof_command_sequence(android_device, buttons, combo_sequence,
                                wait_time_for_another_force_s,
-                               button_press_delay_s):
+                               button_press_delay_s,
+                               layout=None,
+                               clock=time):
     """ 
         Perform the string of combos in Another Eden using taps
         based on the percentages in COMMAND_BUTTONS for (X, Y)
@@ -78,6 +110,9 @@ def start_kof_command_sequence(android_device, buttons, combo_sequence,
         4 = HK
 
         However, you must do this by first entering another force.
+        When a ButtonLayout is given, any button missing from it is
+        located while the command buttons are on screen, and buttons
+        is updated with the calibrated coordinates.
     """
     # Trigger Another Force by tapping the "MAX" button which should be ORANGE.
     print(">> Pressing AF/MAX button...")
@@ -86,7 +121,11 @@ def start_kof_command_sequence(android_device, buttons, combo_sequence,
     
     # Wait for a few seconds for another force animation to complete:
     print(">> Waiting %s seconds for AF animation to complete." % wait_time_for_another_force_s)
-    time.sleep(float(wait_time_for_another_force_s))
+    clock.sleep(float(wait_time_for_another_force_s))
+
+    # The command buttons are only visible after AF, so this is the first chance to locate them.
+    if layout is not None and not layout.has_buttons(android_device, COMMAND_BUTTONS):
+        buttons.update(layout.get_buttons(android_device, COMMAND_BUTTONS))
 
     # Press all the buttons necessary to perform the desired combo string.
     #print("[ANOTHER EDEN] Performing KOF Combo String = %s!" % combo_string)
@@ -118,7 +157,7 @@ def start_kof_command_sequence(android_device, buttons, combo_sequence,
         # Only add a delay if this is not the last action in the sequence
         if idx < (len(combo_sequence) - 1):
             # Add some delay for the button press.
-            time.sleep(float(button_press_delay_s))
+            clock.sleep(float(button_press_delay_s))
 
     print("END")
 
@@ -186,7 +225,8 @@ def generate_chain(chain_string, command_list, fighter):
 
 def kof_battler_cli(android_device, buttons, command_list,
                     wait_time_for_another_force_s,
-                    button_press_delay_s):
+                    button_press_delay_s,
+                    layout=None):
     """
         Basically a CLI Menu for user to specify desired commands
         into the KOF battle after reading either a:
@@ -197,6 +237,9 @@ def kof_battler_cli(android_device, buttons, command_list,
         the user must use their own judgement to correctly
         perform the actions to perform the desired combos.
 
+        The command buttons are located with the ButtonLayout (if given)
+        on the first command.
+
         REQUIREMENTS:
             - Must be your turn
             - Must have orange bar.
@@ -271,7 +314,11 @@ def kof_battler_cli(android_device, buttons, command_list,
                                        buttons=buttons,
                                        combo_sequence=combo_sequence,
                                        wait_time_for_another_force_s=wait_time_for_another_force_s,
-                                       button_press_delay_s=button_press_delay_s)
+                                       button_press_delay_s=button_press_delay_s,
+                                       layout=layout)
+
+            # The buttons are only located once, even if some of them could not be found.
+            layout = None
             
             # After the command finishes, prompt user if they want to continue to use
             # the same fighter, or change the figher.
@@ -282,6 +329,230 @@ def kof_battler_cli(android_device, buttons, command_list,
                 continue
             
 
+def classify_kof_bar_sample(sample):
+    """
+        Reads the AF/MAX bar color from the sampled area around the AF button:
+            "orange" = Another Force/MAX is ready for combos
+            "blue" = Can perform Super
+            None = Not our turn, or input is not accepted yet
+    """
+    # Only the saturated pixels belong to a lit bar, the rest is background.
+    hsv = cv2.cvtColor(sample, cv2.COLOR_BGR2HSV).reshape(-1, 3)
+    lit_pixels = hsv[(hsv[:, 1] >= BAR_MIN_SATURATION) & (hsv[:, 2] >= BAR_MIN_VALUE)]
+    if len(lit_pixels) < BAR_MIN_LIT_RATIO * len(hsv):
+        return None
+
+    hue = numpy.median(lit_pixels[:, 0])
+    for bar_state, hue_range in BAR_HUES.items():
+        if hue_range[0] <= hue <= hue_range[1]:
+            return bar_state
+
+    return None
+
+
+def capture_kof_frame(android_device):
+    """ Captures the screen and returns it decoded as a BGR frame, or None if the capture failed. """
+    screen = android_device.capture_screen()
+    if not screen:
+        return None
+
+    return cv2.imdecode(numpy.frombuffer(screen, dtype=numpy.uint8), cv2.IMREAD_COLOR)
+
+
+def read_kof_bar_state(android_device, buttons, frame=None):
+    """
+        Returns the AF/MAX bar state next to the AF button on the frame (see
+        classify_kof_bar_sample), capturing the screen if no frame is given.
+    """
+    if frame is None:
+        frame = capture_kof_frame(android_device)
+        if frame is None:
+            return None
+
+    # Scale the AF button coordinates from the screen resolution to the captured frame.
+    frame_height, frame_width = frame.shape[:2]
+    center_x = int(buttons["AF"][0] * frame_width / android_device.screen_resolution[0])
+    center_y = int(buttons["AF"][1] * frame_height / android_device.screen_resolution[1])
+    half_width = max(1, int(frame_width * BAR_SAMPLE_SIZE[0] / 2))
+    half_height = max(1, int(frame_height * BAR_SAMPLE_SIZE[1] / 2))
+    sample = frame[max(0, center_y - half_height):center_y + half_height,
+                   max(0, center_x - half_width):center_x + half_width]
+
+    return classify_kof_bar_sample(sample)
+
+
+def obtain_kof_results_cache(android_device, layout, save=False, verbose=False):
+    """
+        Returns a ScreenStateCache which finds the RESULTS_SCREEN template
+        with the layout, or None if there is no such template. The template
+        matching is slow enough to keep it from running on every sample,
+        while the cache only needs it for screens it hasn't seen before.
+        With save, the learned screens are kept per device.
+    """
+    if not layout.has_templates([RESULTS_SCREEN]):
+        return None
+
+    return ScreenStateCache(classifier=functools.partial(layout.find_screen, screen_names=[RESULTS_SCREEN]),
+                            cache_file=device_cache_file(android_device, "kof_screen") if save else None,
+                            verbose=verbose)
+
+
+def plan_autopilot_chains(command_list):
+    """
+        Picks the best chain for each fighter and bar state ahead of time so the
+        autopilot only needs a lookup on its turn.
+
+        The best chain is the true combo with the most combos chained together,
+        and then the most button presses. A blue bar ends the chain with the super.
+    """
+    chain_plan = {}
+    for fighter in command_list:
+        chain_plan[fighter] = {}
+        for bar_state in ["orange", "blue"]:
+            best_score = None
+            for chain_length in range(1, AUTOPILOT_MAX_CHAIN_LENGTH + 1):
+                for combos in itertools.product("123", repeat=chain_length):
+                    chain_string = "".join(combos)
+                    if bar_state == "blue":
+                        chain_string = chain_string[1:] + "S"
+
+                    _, true_combo_flag, chained_sequence = generate_chain(chain_string=chain_string,
+                                                                          command_list=command_list,
+                                                                          fighter=fighter)
+                    score = (len(chain_string), len(chained_sequence))
+                    if true_combo_flag and (best_score is None or score > best_score):
+                        best_score = score
+                        chain_plan[fighter][bar_state] = (chain_string, chained_sequence)
+
+    return chain_plan
+
+
+def kof_battler_autopilot(android_device, buttons, command_list, fighters,
+                          wait_time_for_another_force_s,
+                          button_press_delay_s,
+                          poll_interval_s,
+                          idle_tap_time_s,
+                          new_battle_time_s=AUTOPILOT_NEW_BATTLE_TIME_S,
+                          layout=None,
+                          state_cache=None,
+                          clock=time):
+    """
+        Non-interactive version of kof_battler_cli which plays whole
+        battles unattended by reading the AF/MAX bar from the screen:
+            ORANGE BAR = Perform the best chain of combos
+            BLUE BAR = Perform the best chain ending with the Super
+
+        The fighters are used in turn order from the first fighter at the
+        start of every battle, so pass a single fighter if the same fighter
+        is always active. When no turn is detected for idle_tap_time_s
+        seconds, the screen is tapped to skip the results and any dialogs
+        between battles.
+
+        The command buttons are located with the ButtonLayout (if given)
+        on the first turn. A battle is over once the layout finds the
+        RESULTS_SCREEN template on the screen before an idle tap, or without
+        the template, after new_battle_time_s seconds without a turn. Long
+        enemy turns and super animations keep the fighter order going.
+
+        The state_cache from obtain_kof_results_cache makes it cheap enough
+        to look for the results screen on every sample, so it is skipped
+        as soon as it shows. The cache is saved after every turn.
+
+        REQUIREMENTS:
+            - opencv-python and numpy must be installed
+            - Fighters must be in the KOF Symphony command list
+    """
+    chain_plan = plan_autopilot_chains(command_list)
+
+    print("=====================================================")
+    print("----- KOF Battle Autopilot")
+    print("=====================================================")
+    for fighter in fighters:
+        print(">> [ %s ] ORANGE = %s, BLUE = %s" % (fighter, chain_plan[fighter]["orange"][0], chain_plan[fighter]["blue"][0]))
+
+    screen_center = (int(android_device.screen_resolution[0] * 0.50), int(android_device.screen_resolution[1] * 0.50))
+    results_detectable = state_cache is not None or (layout is not None and layout.has_templates([RESULTS_SCREEN]))
+    calibration_layout = layout
+    turn_counter = 0
+    fighter_index = 0
+    last_turn_time = clock.monotonic()
+    last_bar_time = last_turn_time
+    while(True):
+        # The decision latency covers reading the screen up to the first button press.
+        decision_start = clock.perf_counter()
+        frame = capture_kof_frame(android_device)
+        bar_state = read_kof_bar_state(android_device, buttons, frame=frame) if frame is not None else None
+        if bar_state is None:
+            # Without the state cache, the template matching for the results screen only runs before an idle tap.
+            on_results = state_cache is not None and frame is not None and state_cache.classify(frame) == RESULTS_SCREEN
+            if on_results or clock.monotonic() - last_turn_time >= idle_tap_time_s:
+                if state_cache is None and results_detectable and frame is not None:
+                    on_results = layout.find_screen(frame, [RESULTS_SCREEN]) == RESULTS_SCREEN
+
+                # Only once the battle is over does the next turn start with the first fighter again.
+                if results_detectable:
+                    battle_over = on_results
+                else:
+                    battle_over = clock.monotonic() - last_bar_time >= new_battle_time_s
+                if battle_over and fighter_index != 0:
+                    print(">> [AUTOPILOT] The battle is over, the next turn starts with fighter [ %s ]." % fighters[0])
+                    fighter_index = 0
+
+                if on_results:
+                    print(">> [AUTOPILOT] Results screen detected, tapping the screen.")
+                else:
+                    print(">> [AUTOPILOT] No turn detected for %s seconds, tapping the screen." % idle_tap_time_s)
+                android_device.perform_tap(x=screen_center[0], y=screen_center[1])
+                last_turn_time = clock.monotonic()
+            clock.sleep(poll_interval_s)
+            continue
+
+        fighter = fighters[fighter_index % len(fighters)]
+        chain_string, combo_sequence = chain_plan[fighter][bar_state]
+        decision_latency_s = clock.perf_counter() - decision_start
+
+        turn_counter += 1
+        print(">> [AUTOPILOT] Turn %d: %s bar, fighter [ %s ], chain [ %s ], decision latency = %.1f ms" % (
+            turn_counter, bar_state.upper(), fighter, chain_string, decision_latency_s * 1000))
+        if decision_latency_s > AUTOPILOT_LATENCY_BUDGET_S:
+            print(">> [WARNING] Decision latency is over the %.1f ms budget!" % (AUTOPILOT_LATENCY_BUDGET_S * 1000))
+        if state_cache is not None:
+            cache_statistics = state_cache.get_statistics()
+            print(">> [AUTOPILOT] State cache hit rate = %.1f%%, time saved = %.1f ms" % (
+                cache_statistics["hit_rate"] * 100, cache_statistics["time_saved_s"] * 1000))
+
+        start_kof_command_sequence(android_device=android_device,
+                                   buttons=buttons,
+                                   combo_sequence=combo_sequence,
+                                   wait_time_for_another_force_s=wait_time_for_another_force_s,
+                                   button_press_delay_s=button_press_delay_s,
+                                   layout=calibration_layout,
+                                   clock=clock)
+
+        # The buttons are only located once, even if some of them could not be found.
+        calibration_layout = None
+
+        # Wait for the bar to go out so the same turn isn't played twice.
+        last_turn_time = clock.monotonic()
+        bar_went_out = False
+        while clock.monotonic() - last_turn_time < idle_tap_time_s:
+            if read_kof_bar_state(android_device, buttons) is None:
+                bar_went_out = True
+                break
+            clock.sleep(poll_interval_s)
+        last_turn_time = clock.monotonic()
+        last_bar_time = last_turn_time
+
+        # If the bar never went out, the turn didn't go through and the same fighter plays it again.
+        if bar_went_out:
+            fighter_index += 1
+        else:
+            print(">> [AUTOPILOT] The bar is still lit after %s seconds, retrying the turn." % idle_tap_time_s)
+
+        if state_cache is not None:
+            state_cache.save()
+
+
 def run_android_macros(args):
     """ Runs device series of macros for your Another Eden. """
 
@@ -293,31 +564,64 @@ def run_android_macros(args):
     # Connect to the Android Device and obtain the handle. 
     android_device = obtain_device_configuration(args)
 
-    # Obtain the screen size (which will be used for taps and swipes)
-    screen_size = android_device.get_screen_resolution()
-
     # Display the time out parameters.
     print("[ANOTHER EDEN] AF wait time = %s seconds, Button press time = %s seconds." % (
         args.another_force_wait_time,
         args.button_press_click_time))
 
-    # Obtain the coordinates of the buttons for KOF Symphony battles
-    command_buttons = obtain_kof_battle_buttons(screen_size)
+    # Obtain the coordinates of the buttons for KOF Symphony battles, the layout locates them after the first AF.
+    layout = ButtonLayout(verbose=args.verbose)
+    command_buttons = obtain_kof_battle_buttons(android_device, recalibrate=args.recalibrate, layout=layout)
+
+    if args.autopilot:
+        fighters = [fighter.strip().lower() for fighter in args.autopilot.split(",")]
+        unsupported_fighters = [fighter for fighter in fighters if fighter not in kof_commands_list]
+        if unsupported_fighters:
+            print("[ANOTHER EDEN] Error, unsupported fighters %s! (SUPPORTED=%s)" % (unsupported_fighters, list(kof_commands_list.keys())))
+            return
+        if cv2 is None:
+            print("[ANOTHER EDEN] Error, the autopilot needs opencv-python and numpy to read the screen!")
+            return
+
+        state_cache = None
+        if args.state_cache:
+            state_cache = obtain_kof_results_cache(android_device, layout, save=True, verbose=args.verbose)
+            if state_cache is None:
+                print("[ANOTHER EDEN] No %s.png template, so the results screen is only checked before an idle tap." % RESULTS_SCREEN)
+
+        # Play every turn automatically until the user exits the tool.
+        kof_battler_autopilot(android_device, command_buttons, kof_commands_list, fighters,
+                              wait_time_for_another_force_s=args.another_force_wait_time,
+                              button_press_delay_s=args.button_press_click_time,
+                              poll_interval_s=args.autopilot_poll_time,
+                              idle_tap_time_s=args.autopilot_idle_tap_time,
+                              new_battle_time_s=args.autopilot_new_battle_time,
+                              layout=layout,
+                              state_cache=state_cache)
+        return
 
     # Loop a menu here where the user specifies the following:
     # Name of the fighter, the command to perform, or a chain.
     # TODO: Allow chaining series of combos like 123S or 2321
     kof_battler_cli(android_device, command_buttons, kof_commands_list,
                     wait_time_for_another_force_s=args.another_force_wait_time,
-                    button_press_delay_s=args.button_press_click_time)
+                    button_press_delay_s=args.button_press_click_time,
+                    layout=layout)
     
 
-# Use parser for the help menu and to return as args to the main function..
-parser = argparse.ArgumentParser(prog='ANOTHER EDEN KOF Symphony Battler Script', description='Runs desired sequence of Android macros for your connected android device for the ANOTHER EDEN mobile game.')
-parser.add_argument("--serial_number", "-s", action='store', type=str, required=True, help='Serial Number of Android device as seen by adb')
-parser.add_argument("--another_force_wait_time", action='store', type=float, default=1.5, required=False, help='Time delay to wait for AF animation to finish.')
-parser.add_argument("--button_press_click_time", action='store', type=float, default=0.75, required=False, help='Time delay to wait for AF animation to finish.')
-parser.add_argument("--verbose", action='store_true', help='Shows raw command output.')
-parser.add_argument('--version', action='version', version='%(prog)s 1.0')
-args = parser.parse_args()
-run_android_macros(args)
\ No newline at end of file
+if __name__ == "__main__":
+    # Use parser for the help menu and to return as args to the main function..
+    parser = argparse.ArgumentParser(prog='ANOTHER EDEN KOF Symphony Battler Script', description='Runs desired sequence of Android macros for your connected android device for the ANOTHER EDEN mobile game.')
+    parser.add_argument("--serial_number", "-s", action='store', type=str, required=True, help='Serial Number of Android device as seen by adb')
+    parser.add_argument("--another_force_wait_time", action='store', type=float, default=1.5, required=False, help='Time delay to wait for AF animation to finish.')
+    parser.add_argument("--button_press_click_time", action='store', type=float, default=0.75, required=False, help='Time delay to wait for AF animation to finish.')
+    parser.add_argument("--recalibrate", action='store_true', help='Locates the battle buttons again instead of using the cached layout.')
+    parser.add_argument("--autopilot", action='store', type=str, required=False, help='Plays every turn without prompts, using the comma separated fighters in turn order (ie. kyo,mai).')
+    parser.add_argument("--autopilot_poll_time", action='store', type=float, default=0.1, required=False, help='Time delay between screen samples while waiting for your turn.')
+    parser.add_argument("--autopilot_idle_tap_time", action='store', type=float, default=10.0, required=False, help='Time without a turn before tapping the screen to skip results.')
+    parser.add_argument("--autopilot_new_battle_time", action='store', type=float, default=AUTOPILOT_NEW_BATTLE_TIME_S, required=False, help='Time without a turn before the next turn starts with the first fighter again, when there is no RESULTS.png template.')
+    parser.add_argument("--state_cache", action='store_true', help='Looks for the results screen on every sample through a screen state cache saved per device, so results are skipped right away.')
+    parser.add_argument("--verbose", action='store_true', help='Shows raw command output.')
+    parser.add_argument('--version', action='version', version='%(prog)s 1.0')
+    args = parser.parse_args()
+    run_android_macros(args)
@@ -21,10 +21,134 @@
 """
 import android_adb as Android
 import argparse
+from button_layout import ButtonLayout
 import time
 
+try:
+    import cv2
+    import numpy
+except ImportError:
+    cv2 = None
+    numpy = None
 
-def another_eden_overworld_auto_battler(args):
+OVERWORLD_BUTTONS = {
+    "ATTACK": (0.80, 0.80)
+}
+
+# Mean grayscale difference (0-255) between two captures in a row which means an encounter has started.
+ENCOUNTER_DIFF_THRESHOLD = 40
+
+# Mean grayscale difference (0-255) below which the screen counts as frozen. The field always moves while
+# walking, so a frozen screen means the game is on another screen (ie. a missed results screen).
+STILL_DIFF_THRESHOLD = 1.0
+
+# Without opencv-python (or without any captures) the encounter can't be seen, so the walk lasts as long as
+# the three swipes did.
+UNDETECTED_WALK_TIME_S = 9.0
+
+# Template (in the button layout TEMPLATE_DIR) of something only the results screen shows.
+RESULTS_SCREEN = "RESULTS"
+
+
+def capture_encounter_sample(android_device):
+    """ Returns a small grayscale capture of the screen which is cheap to compare, or None if it isn't available. """
+    if cv2 is None:
+        return None
+
+    screen = android_device.capture_screen()
+    if not screen:
+        return None
+
+    # A 1/8 size sample keeps the comparison cheap, and is enough to tell the field from a battle.
+    return cv2.imdecode(numpy.frombuffer(screen, dtype=numpy.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+
+
+def read_overworld_screen(android_device, layout):
+    """ Captures the screen and returns "ATTACK" in battle or RESULTS_SCREEN on the results if the layout finds either, or None. """
+    screen = android_device.capture_screen()
+    if not screen:
+        return None
+
+    frame = cv2.imdecode(numpy.frombuffer(screen, dtype=numpy.uint8), cv2.IMREAD_GRAYSCALE)
+    if frame is None:
+        return None
+    return layout.find_screen(frame, ["ATTACK", RESULTS_SCREEN])
+
+
+def hold_walk_until_encounter(android_device, left, right, args, max_walk_time=None, layout=None, clock=time):
+    """
+        Holds the finger down on the field and walks left and right,
+        comparing every capture of the screen with the one before it.
+        The camera only pans a little between two captures, while the
+        encounter changes the whole screen.
+
+        Returns True as soon as an encounter is detected, or after
+        UNDETECTED_WALK_TIME_S seconds without a single capture, as if
+        opencv-python wasn't installed. Returns False after max_walk_time
+        seconds without either (if given). The finger is always released,
+        even if the tool is stopped while walking.
+
+        A screen which stays frozen for two strides may be a missed battle
+        or results screen, or just a still part of the field. Only when the
+        layout (if given) finds the attack button on it does it count as
+        an encounter. Otherwise the screen is tapped (to skip any results)
+        and pressed again.
+    """
+    # Press in the middle, then hold the finger to one side to keep walking that way.
+    center = (int((left[0] + right[0]) / 2), int((left[1] + right[1]) / 2))
+    targets = [left, right]
+    stride = 0
+    android_device.perform_press(x=center[0], y=center[1])
+    try:
+        android_device.perform_move(x=targets[0][0], y=targets[0][1])
+        previous_sample = capture_encounter_sample(android_device)
+
+        walk_start = clock.monotonic()
+        stride_start = walk_start
+        last_change = walk_start
+        last_capture = walk_start
+        while max_walk_time is None or clock.monotonic() - walk_start < max_walk_time:
+            clock.sleep(args.encounter_poll_time)
+
+            sample = capture_encounter_sample(android_device)
+            if previous_sample is not None and sample is not None and sample.shape == previous_sample.shape:
+                difference = cv2.absdiff(sample, previous_sample).mean()
+                if difference >= ENCOUNTER_DIFF_THRESHOLD:
+                    return True
+                if difference >= STILL_DIFF_THRESHOLD:
+                    last_change = clock.monotonic()
+                elif clock.monotonic() - last_change >= 2 * args.walk_stride_time:
+                    still_time = clock.monotonic() - last_change
+                    screen = read_overworld_screen(android_device, layout) if layout is not None else None
+                    if screen == "ATTACK":
+                        print("[ANOTHER EDEN] The screen hasn't changed for %.1f seconds, and shows the attack button." % still_time)
+                        return True
+
+                    print("[ANOTHER EDEN] The screen hasn't changed for %.1f seconds, tapping it and pressing again." % still_time)
+                    android_device.perform_release(x=targets[stride % 2][0], y=targets[stride % 2][1])
+                    android_device.perform_tap(x=center[0], y=center[1])
+                    android_device.perform_press(x=center[0], y=center[1])
+                    android_device.perform_move(x=targets[stride % 2][0], y=targets[stride % 2][1])
+                    last_change = clock.monotonic()
+            if sample is not None:
+                previous_sample = sample
+                last_capture = clock.monotonic()
+            elif clock.monotonic() - last_capture >= UNDETECTED_WALK_TIME_S:
+                print("[ANOTHER EDEN] No screen captures for %.1f seconds, carrying on as if an encounter started." % (clock.monotonic() - last_capture))
+                return True
+
+            # Turn around at the end of every stride.
+            if clock.monotonic() - stride_start >= args.walk_stride_time:
+                stride += 1
+                android_device.perform_move(x=targets[stride % 2][0], y=targets[stride % 2][1])
+                stride_start = clock.monotonic()
+
+        return False
+    finally:
+        android_device.perform_release(x=targets[stride % 2][0], y=targets[stride % 2][1])
+
+
+def another_eden_overworld_auto_battler(args, android_device=None, clock=time, layout=None):
     """ 
         Continuously loop battles in Another Eden overworld.
 
@@ -36,11 +160,16 @@ def another_eden_overworld_auto_battler(args):
             - 1 front-line unit should give 0 MP on frontline at battle start
             - No switching, kills mobs on turn 1
             - No AF
+
+        An already connected android_device (ie. the simulator) skips the
+        start prompt, and all waiting is done through the given clock.
+        A ButtonLayout can be given to use a different cache file.
     """
-    # Connect to the Android Phone.
-    android_device = Android.AndroidUSB(device_sn=args.serial_number)
-    
-    input("================ Press ENTER to start the auto-battler ================ ")
+    if android_device is None:
+        # Connect to the Android Phone.
+        android_device = Android.AndroidUSB(device_sn=args.serial_number)
+
+        input("================ Press ENTER to start the auto-battler ================ ")
     screen_size = android_device.get_screen_resolution()
 
     # based on screen-size, calculate approximate coordinates to swipe left and right.
@@ -51,27 +180,52 @@ def another_eden_overworld_auto_battler(args):
     left = (swipe_x1, swipe_y1)
     right = (swipe_x2, swipe_y2)
 
-    # Calculate the X and Y coordinates for the Attack Button.
-    tap_x = int(screen_size[0] * 0.80)
-    tap_y = int(screen_size[1] * 0.80)
+    # Obtain the X and Y coordinates for the Attack Button from the calibrated layout. It isn't
+    # visible on the field, so it is only searched for once the first battle starts.
+    if layout is None:
+        layout = ButtonLayout()
+    buttons = layout.get_buttons(android_device, OVERWORLD_BUTTONS, recalibrate=args.recalibrate, calibrate=False)
+    tap_x = buttons["ATTACK"][0]
+    tap_y = buttons["ATTACK"][1]
     
     battle_counter = 1
     while True:
-        # Move from right to left 3 times
-        print("[ANOTHER EDEN] Moving left and right on field 3 times...")
-        android_device.perform_swipe(coord1=left, coord2=right, length_ms=3000)
-        android_device.perform_swipe(coord1=right, coord2=left, length_ms=3000)
-        android_device.perform_swipe(coord1=left, coord2=right, length_ms=3000)
-        #android_device.perform_swipe(coord1=(277, 605), coord2=(1898, 605), length_ms=3000)
-        #android_device.perform_swipe(coord1=(1898, 605), coord2=(277, 605), length_ms=3000)
-        #android_device.perform_swipe(coord1=(277, 605), coord2=(1898, 605), length_ms=3000)
+        if args.swipe_walk:
+            # Move from right to left 3 times
+            print("[ANOTHER EDEN] Moving left and right on field 3 times...")
+            android_device.perform_swipe(coord1=left, coord2=right, length_ms=3000)
+            android_device.perform_swipe(coord1=right, coord2=left, length_ms=3000)
+            android_device.perform_swipe(coord1=left, coord2=right, length_ms=3000)
+            #android_device.perform_swipe(coord1=(277, 605), coord2=(1898, 605), length_ms=3000)
+            #android_device.perform_swipe(coord1=(1898, 605), coord2=(277, 605), length_ms=3000)
+            #android_device.perform_swipe(coord1=(277, 605), coord2=(1898, 605), length_ms=3000)
+        else:
+            if cv2 is None:
+                print("[ANOTHER EDEN] Walking left and right on field for %s seconds..." % (args.max_walk_time or UNDETECTED_WALK_TIME_S))
+                hold_walk_until_encounter(android_device, left, right, args,
+                                          max_walk_time=args.max_walk_time or UNDETECTED_WALK_TIME_S, layout=layout, clock=clock)
+            else:
+                # Keep walking left and right until the encounter starts.
+                print("[ANOTHER EDEN] Walking left and right on field until an encounter...")
+                walk_start = clock.monotonic()
+                if not hold_walk_until_encounter(android_device, left, right, args,
+                                                 max_walk_time=args.max_walk_time, layout=layout, clock=clock):
+                    print("[ANOTHER EDEN] No encounter detected after %s seconds, walking again." % args.max_walk_time)
+                    continue
+                print("[ANOTHER EDEN] Encounter detected after %.1f seconds." % (clock.monotonic() - walk_start))
 
         # Wait a few seconds for battle to start
         print("[ANOTHER EDEN] Wait %s seconds for battle to start." % args.battle_start_time)
-        time.sleep(args.battle_start_time)
+        clock.sleep(args.battle_start_time)
 
         print("\n[ANOTHER EDEN] ========= STARTED OVERWORLD BATTLE # %d =========" % battle_counter)
 
+        # The Attack Button is only visible in battle, so locate it on the first battle if it isn't cached yet.
+        if battle_counter == 1 and not layout.has_buttons(android_device, OVERWORLD_BUTTONS):
+            buttons = layout.get_buttons(android_device, OVERWORLD_BUTTONS)
+            tap_x = buttons["ATTACK"][0]
+            tap_y = buttons["ATTACK"][1]
+
         # Press the Attack Button
         print("[ANOTHER EDEN] Press attack button once.")
         android_device.perform_tap(x=tap_x, y=tap_y, repeat_count=2, repeat_interval_ms=1000)
@@ -79,7 +233,7 @@ def another_eden_overworld_auto_battler(args):
 
         # Wait a few seconds for battle to end
         print("[ANOTHER EDEN] Wait %s seconds for battle to end." % args.battle_end_time)
-        time.sleep(args.battle_end_time)
+        clock.sleep(args.battle_end_time)
 
         # Tap anywhere on the screen
         print("[ANOTHER EDEN] Press attack button once.")
@@ -88,7 +242,7 @@ def another_eden_overworld_auto_battler(args):
 
         # Wait a few seconds to return to battlefield
         print("[ANOTHER EDEN] Wait %s seconds to return to the battlefield." % args.return_to_battlefield_time)
-        time.sleep(args.return_to_battlefield_time)
+        clock.sleep(args.return_to_battlefield_time)
 
         # Incrememnt the battle counter
         battle_counter +=1
@@ -100,12 +254,19 @@ def run_android_macros(args):
     # Auto-battler that loops infinitely for overworld farming. 
     another_eden_overworld_auto_battler(args)
 
-# Use parser for the help menu and to return as args to the main function..
-parser = argparse.ArgumentParser(prog='ANOTHER EDEN Android Macro script', description='Runs desired sequence of Android macros for your connected android device for the ANOTHER EDEN mobile game.')
-parser.add_argument("--serial_number", "-s", action='store', type=str, required=True, help='Serial Number of Android device as seen by adb')
-parser.add_argument("--battle_start_time", action='store', type=int, required=False, default=4, help='Battle Start wait time in seconds.')
-parser.add_argument("--battle_end_time", action='store', type=int, required=False, default=5, help='Battle Start wait time in seconds.')
-parser.add_argument("--return_to_battlefield_time", action='store', type=int, required=False, default=4, help='Battle Start wait time in seconds.')
-parser.add_argument('--version', action='version', version='%(prog)s 1.0')
-args = parser.parse_args()
-run_android_macros(args)
\ No newline at end of file
+
+if __name__ == "__main__":
+    # Use parser for the help menu and to return as args to the main function..
+    parser = argparse.ArgumentParser(prog='ANOTHER EDEN Android Macro script', description='Runs desired sequence of Android macros for your connected android device for the ANOTHER EDEN mobile game.')
+    parser.add_argument("--serial_number", "-s", action='store', type=str, required=True, help='Serial Number of Android device as seen by adb')
+    parser.add_argument("--battle_start_time", action='store', type=int, required=False, default=4, help='Battle Start wait time in seconds.')
+    parser.add_argument("--battle_end_time", action='store', type=int, required=False, default=5, help='Battle Start wait time in seconds.')
+    parser.add_argument("--return_to_battlefield_time", action='store', type=int, required=False, default=4, help='Battle Start wait time in seconds.')
+    parser.add_argument("--max_walk_time", action='store', type=float, required=False, help='Releases and walks again after this many seconds without an encounter (default: walk until an encounter, or 9 seconds without opencv-python).')
+    parser.add_argument("--walk_stride_time", action='store', type=float, required=False, default=3.0, help='Time to walk in one direction before turning around in seconds.')
+    parser.add_argument("--encounter_poll_time", action='store', type=float, required=False, default=0.2, help='Time delay between encounter checks while walking in seconds.')
+    parser.add_argument("--swipe_walk", action='store_true', help='Walks with three fixed swipes instead of holding until an encounter.')
+    parser.add_argument("--recalibrate", action='store_true', help='Locates the attack button again instead of using the cached layout.')
+    parser.add_argument('--version', action='version', version='%(prog)s 1.0')
+    args = parser.parse_args()
+    run_android_macros(args)
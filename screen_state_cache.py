@@ -0,0 +1,291 @@
+"""
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Library Description:
+        Memoizes a screen classifier by the perceptual hash of the frames
+        it is given, so that the screens which keep repeating during a
+        session only go through the expensive classifier once.
+
+   Usage:
+   -------------
+   state_cache = ScreenStateCache(classifier=classify_screen,
+                                  cache_file=device_cache_file(android_device, "screen"))
+   state = state_cache.classify(frame)
+   print(state_cache.get_statistics())
+   state_cache.save()
+
+   python -m screen_state_cache --check
+
+   Frames are keyed by the dHash of their layout, and frames within a few
+   bits of each other share a state. This suits classifiers that tell
+   whole screens apart (ie. template matching), not ones that threshold
+   small differences in color, which a hash of a thumbnail can't see.
+
+   Frames are BGR (or grayscale) numpy arrays as decoded by opencv-python,
+   which is needed along with numpy. Classifier states must be JSON
+   serializable (ie. strings or None) for the cache to be saved.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+try:
+    import cv2
+    import numpy
+except ImportError:
+    cv2 = None
+    numpy = None
+
+CACHE_FILE_FORMAT = "screen_state_cache_{device_sn}_{name}.json"
+MAX_ENTRIES = 256
+
+# Maximum number of differing hash bits for two frames to count as the same screen.
+MAX_HASH_DISTANCE = 4
+
+# Minimum brightness step (0-255) between two thumbnail pixels to set a dHash bit, so that
+# noise and small animations over flat areas of the screen don't flip any bits.
+DHASH_MIN_STEP = 4
+
+
+def device_cache_file(android_device, name):
+    """ Returns the cache file name for the device and the classifier name. """
+    return CACHE_FILE_FORMAT.format(device_sn=android_device.serial_number, name=name)
+
+
+def dhash(frame):
+    """
+        Returns the 64-bit dHash of the frame, where each bit is whether a
+        pixel of a 9x8 grayscale thumbnail is brighter than its right neighbour
+        by at least DHASH_MIN_STEP.
+    """
+    # Shrinking straight to 9x8 by area is slow on a full size capture, so the frame is first
+    # sampled down to a whole multiple of the thumbnail, which the area average is fast on.
+    thumbnail = cv2.resize(frame, (9 * 8, 8 * 8), interpolation=cv2.INTER_LINEAR)
+    if thumbnail.ndim == 3:
+        thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+    thumbnail = cv2.resize(thumbnail, (9, 8), interpolation=cv2.INTER_AREA).astype(numpy.int16)
+
+    gradient_bits = numpy.packbits(thumbnail[:, 1:] - thumbnail[:, :-1] >= DHASH_MIN_STEP)
+    return numpy.uint64(int.from_bytes(gradient_bits.tobytes(), "big"))
+
+
+class ScreenStateCache(object):
+    """ Bounded LRU cache of classifier states keyed by perceptual frame hashes. """
+
+    def __init__(self, classifier, cache_file=None, max_entries=MAX_ENTRIES,
+                 max_distance=MAX_HASH_DISTANCE, verbose=False):
+        """
+            Wraps the classifier, loading the previously learned screens from
+            cache_file if given. Frames whose dHash differs in at most
+            max_distance bits from a cached frame get its state.
+        """
+        self._classifier = classifier
+        self._cache_file = cache_file
+        self._max_entries = max_entries
+        self._max_distance = max_distance
+        self._verbose = verbose
+
+        # Parallel arrays so every lookup compares against all entries at once.
+        self._hashes = numpy.zeros(max_entries, dtype=numpy.uint64)
+        self._last_used = numpy.zeros(max_entries, dtype=numpy.int64)
+        self._states = [None] * max_entries
+        self._entry_count = 0
+        self._lookup_count = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._hash_time_s = 0.0
+        self._classifier_time_s = 0.0
+
+        if self._cache_file is not None and os.path.isfile(self._cache_file):
+            self._load()
+
+    def _get_pc_time(self):
+        """ Returns the PC time as a datetime string. """
+        return datetime.datetime.now()
+
+    def _find(self, frame_hash):
+        """ Returns the index of the closest cached entry within max_distance bits, or None. """
+        if self._entry_count == 0:
+            return None
+
+        differing_bits = numpy.bitwise_xor(self._hashes[:self._entry_count], frame_hash).view(numpy.uint8)
+        distances = numpy.unpackbits(differing_bits).reshape(self._entry_count, 64).sum(axis=1)
+
+        index = int(numpy.argmin(distances))
+        if distances[index] > self._max_distance:
+            return None
+        return index
+
+    def _insert(self, frame_hash, state):
+        """ Adds an entry, evicting the least recently used one when the cache is full. """
+        if self._entry_count < self._max_entries:
+            index = self._entry_count
+            self._entry_count += 1
+        else:
+            index = int(numpy.argmin(self._last_used))
+
+        self._hashes[index] = frame_hash
+        self._states[index] = state
+        self._last_used[index] = self._lookup_count
+
+    def classify(self, frame):
+        """ Returns the cached state of a matching frame, or runs the classifier and caches its state. """
+        self._lookup_count += 1
+        hash_start = time.perf_counter()
+        frame_hash = dhash(frame)
+        index = self._find(frame_hash)
+        self._hash_time_s += time.perf_counter() - hash_start
+
+        if index is not None:
+            self._hits += 1
+            self._last_used[index] = self._lookup_count
+            return self._states[index]
+
+        self._misses += 1
+        classifier_start = time.perf_counter()
+        state = self._classifier(frame)
+        self._classifier_time_s += time.perf_counter() - classifier_start
+
+        self._insert(frame_hash, state)
+        return state
+
+    def get_statistics(self):
+        """
+            Returns the hit rate along with the estimated time saved, which is
+            the average classifier time for every hit minus all of the time
+            spent hashing frames.
+        """
+        lookups = self._hits + self._misses
+        average_classifier_time_s = self._classifier_time_s / self._misses if self._misses else 0.0
+        return {"entries": self._entry_count,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / float(lookups) if lookups else 0.0,
+                "time_saved_s": self._hits * average_classifier_time_s - self._hash_time_s}
+
+    def save(self):
+        """ Writes the cached screens to the cache file, least recently used first. """
+        if self._cache_file is None:
+            return
+
+        order = numpy.argsort(self._last_used[:self._entry_count], kind="stable")
+        entries = [["%016x" % int(self._hashes[index]), self._states[index]] for index in order]
+        with open(self._cache_file, 'w') as file:
+            json.dump({"entries": entries}, file)
+
+        if self._verbose:
+            print("[ %s ] >> [CACHE] Saved %s screens to %s." % (self._get_pc_time(), len(entries), self._cache_file))
+
+    def _load(self):
+        """ Loads the cached screens from the cache file, so a warm start skips learning them again. """
+        with open(self._cache_file, 'r') as file:
+            entries = json.load(file)["entries"]
+
+        # Only the most recently used entries are kept if the cache is now smaller,
+        # and entries from the older [hash, color, state] format are skipped.
+        for entry in entries[-self._max_entries:]:
+            if len(entry) != 2:
+                continue
+            frame_hash, state = entry
+            self._lookup_count += 1
+            self._insert(numpy.uint64(int(frame_hash, 16)), state)
+
+        print("[ %s ] >> [CACHE] Loaded %s screens from %s." % (self._get_pc_time(), self._entry_count, self._cache_file))
+
+
+def check_screen_state_cache(seed=1):
+    """
+        Returns the failures of a ScreenStateCache in front of a slow classifier
+        on synthetic screens: noisy captures of the same screen must be hits
+        with its state, other screens must not be, the least recently used
+        screen must be evicted first, and a saved cache must start warm.
+    """
+    generator = numpy.random.RandomState(seed)
+    screens = []
+    for _ in range(6):
+        screen = numpy.full((270, 600, 3), 80, dtype=numpy.uint8)
+        for _ in range(8):
+            x, y = generator.randint(0, 560), generator.randint(0, 240)
+            cv2.rectangle(screen, (x, y), (x + generator.randint(20, 200), y + generator.randint(10, 120)), generator.randint(0, 256, 3).tolist(), -1)
+        screens.append(screen)
+
+    def capture(index):
+        """ Returns a capture of the screen with some sensor noise. """
+        noise = generator.normal(0, 3, screens[index].shape)
+        return numpy.clip(screens[index] + noise, 0, 255).astype(numpy.uint8)
+
+    def classify_screen(frame):
+        """ Returns the name of the closest screen, slowly, like template matching would. """
+        time.sleep(0.002)
+        differences = [cv2.absdiff(frame, screen).mean() for screen in screens]
+        return "screen_%d" % int(numpy.argmin(differences))
+
+    failures = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache_file = os.path.join(cache_dir, CACHE_FILE_FORMAT.format(device_sn="CHECK", name="screen"))
+        state_cache = ScreenStateCache(classifier=classify_screen, cache_file=cache_file)
+        for index in generator.randint(0, len(screens), 200):
+            state = state_cache.classify(capture(index))
+            if state != "screen_%d" % index:
+                failures.append("screen_%d was classified as %s" % (index, state))
+
+        statistics = state_cache.get_statistics()
+        print("[CACHE] %s screens: hits = %s, misses = %s, time saved = %.1f ms" % (
+            len(screens), statistics["hits"], statistics["misses"], statistics["time_saved_s"] * 1000))
+        if statistics["misses"] > 2 * len(screens):
+            failures.append("%s misses for %s screens" % (statistics["misses"], len(screens)))
+        if statistics["time_saved_s"] <= 0:
+            failures.append("no time was saved")
+
+        # A saved cache knows every screen on the next start.
+        state_cache.save()
+        warm_cache = ScreenStateCache(classifier=classify_screen, cache_file=cache_file)
+        for index in range(len(screens)):
+            warm_cache.classify(capture(index))
+        if warm_cache.get_statistics()["misses"] > 0:
+            failures.append("the saved cache missed %s screens" % warm_cache.get_statistics()["misses"])
+
+    # With room for 3 screens, the one used longest ago makes room for a new one.
+    small_cache = ScreenStateCache(classifier=classify_screen, max_entries=3)
+    for index in [0, 1, 2, 0, 3, 0]:
+        small_cache.classify(capture(index))
+    misses = small_cache.get_statistics()["misses"]
+    small_cache.classify(capture(1))
+    if small_cache.get_statistics()["misses"] != misses + 1 or misses != 4:
+        failures.append("the least recently used screen was not the one evicted")
+
+    return failures
+
+
+if __name__ == "__main__":
+    # Use parser for the help menu and to return as args to the main function..
+    parser = argparse.ArgumentParser(prog='Screen State Cache', description='Checks the screen state cache against a slow classifier on synthetic screens.')
+    parser.add_argument("--check", action='store_true', required=True, help='Runs the check and exits with an error if it fails.')
+    parser.add_argument("--seed", action='store', type=int, default=1, required=False, help='Random seed for the synthetic screens.')
+    args = parser.parse_args()
+
+    if cv2 is None:
+        print("[CACHE] Error, the screen state cache needs opencv-python and numpy!")
+        sys.exit(1)
+
+    failures = check_screen_state_cache(args.seed)
+    for failure in failures:
+        print("[CACHE] CHECK FAILED: %s" % failure)
+    if failures:
+        sys.exit(1)
+    print("[CACHE] CHECK PASSED")